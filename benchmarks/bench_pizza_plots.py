@@ -0,0 +1,176 @@
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pizza_plots
+
+# Benchmarks of the data preparation and rendering hot paths of pizza_plots.py on synthetic leagues.
+# Every source csv is scaled up from the real one, fonts and logos are read from local files only,
+# and charts are rendered into memory buffers so disk writes are not measured.
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SIZES = [20, 2000, 200000]
+
+# Team names of the synthetic leagues, without spaces so they double as logo and chart file names
+def team_names(n_teams):
+    return ["Team%06d" % i for i in range(n_teams)]
+
+# Write every source csv for n_teams teams into data_dir, repeating the real rows with each numeric value
+# scaled by a random factor, so the builders see realistic columns and spreads
+def write_synthetic_sources(data_dir, n_teams, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    teams = team_names(n_teams)
+    for file_name in pizza_plots.SOURCE_FILES:
+        base = pizza_plots.read_source(file_name, REPO_DIR)
+        df = base.iloc[np.arange(n_teams) % len(base)].reset_index(drop=True)
+        df["team"] = teams
+        for column in df.columns[1:]:
+            if not pd.api.types.is_numeric_dtype(df[column]):
+                continue
+            scaled = df[column].to_numpy(dtype=float) * rng.uniform(0.9, 1.1, n_teams)
+            if pd.api.types.is_integer_dtype(base[column]):
+                df[column] = np.rint(scaled).astype(int)
+            else:
+                df[column] = np.round(scaled, 2)
+        df.to_csv(os.path.join(data_dir, file_name), index=False)
+
+# Give each team that gets rendered a logo, copied from a real one when the repo has logos
+def write_logos(logo_dir, names):
+    from PIL import Image
+    os.makedirs(logo_dir, exist_ok=True)
+    real_logo = os.path.join(REPO_DIR, pizza_plots.LOGO_DIR, "Arsenal.png")
+    source = os.path.join(logo_dir, "_logo.png")
+    if os.path.exists(real_logo):
+        shutil.copy(real_logo, source)
+    else:
+        Image.new("RGBA", (200, 200), (200, 30, 30, 255)).save(source)
+    for name in names:
+        shutil.copy(source, os.path.join(logo_dir, name+".png"))
+
+# Call fn repeats times, with setup() run untimed before each call, and once more under tracemalloc for peak memory
+# RSS growth is taken over the timed calls, since the process-wide RSS peak says nothing about a single benchmark
+def measure(fn, setup=None, repeats=3):
+    times = []
+    rss_before = pizza_plots.rss_kb()
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    rss_after = pizza_plots.rss_kb()
+    rss_growth = None if rss_before is None or rss_after is None else rss_after - rss_before
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "wall_s": min(times),
+        "wall_s_median": float(np.median(times)),
+        "runs_s": times,
+        "peak_alloc_kb": peak // 1024,
+        "rss_growth_kb": rss_growth,
+    }
+
+# Run every benchmark for one league size and return one result entry per benchmark
+def bench_size(n_teams, work_dir, repeats=3, render_teams=20):
+    data_dir = os.path.join(work_dir, "data_%d" % n_teams)
+    write_synthetic_sources(data_dir, n_teams)
+    pizza_plots.DATA_DIR = data_dir
+    pizza_plots.clear_cache()
+    names = team_names(n_teams)[:render_teams]
+    write_logos(pizza_plots.LOGO_DIR, names)
+    pizza_plots.warm_resources(names, download=False)
+
+    results = []
+    def record(name, result, charts=None):
+        result = dict(result, benchmark=name, teams=n_teams)
+        if charts:
+            result["charts"] = charts
+            result["charts_per_s"] = charts / result["wall_s"]
+        results.append(result)
+        print("%8d teams  %-32s %9.4f s" % (n_teams, name, result["wall_s"]), file=sys.stderr)
+
+    record("playstyles_data_cold", measure(pizza_plots.playstyles_data, pizza_plots.clear_cache, repeats))
+    record("playstyles_data_warm", measure(pizza_plots.playstyles_data, None, repeats))
+
+    sources = {file_name: pizza_plots.read_source(file_name) for file_name in pizza_plots.SOURCE_FILES}
+    for builder in pizza_plots.ROW_BUILDERS + pizza_plots.LEAGUE_BUILDERS:
+        record("builder_"+builder.__name__, measure(lambda: builder(sources), None, repeats))
+
+    # One team's charts, rendered into buffers instead of OUTPUT_DIR
+    def plot_style():
+        pizza_plots.plot_style(names[0], names[0], outputs={chart: io.BytesIO() for chart in pizza_plots.CHART_SPECS})
+    record("plot_style", measure(plot_style, None, repeats), charts=2)
+
+    # The first render_teams teams' charts, rendered in-process into buffers
+    def plot_styles_for_teams():
+        outputs = {(name, chart): io.BytesIO() for name in names for chart in pizza_plots.CHART_SPECS}
+        errors = [report[3] for report in pizza_plots.plot_styles_for_teams(1, names, outputs) if report[3]]
+        if errors:
+            raise RuntimeError(errors[0])
+    record("plot_styles_for_teams", measure(plot_styles_for_teams, None, repeats), charts=2*len(names))
+    return results
+
+def versions():
+    import matplotlib
+    import mplsoccer
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "mplsoccer": mplsoccer.__version__,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark data preparation and rendering on synthetic leagues.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES, help="league sizes in teams")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per benchmark, the fastest is reported")
+    parser.add_argument("--render-teams", type=int, default=20, help="teams rendered by the batch benchmark")
+    parser.add_argument("--font-dir", default=os.path.join(REPO_DIR, pizza_plots.FONT_DIR),
+                        help="local font directory, missing fonts fall back to DejaVu")
+    parser.add_argument("--work-dir", help="where synthetic csv files and logos are written; default a temporary directory")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    pizza_plots.set_headless()
+    pizza_plots.FONT_DIR = args.font_dir
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="pizza_bench_")
+    pizza_plots.LOGO_DIR = os.path.join(work_dir, "img")
+    try:
+        results = []
+        for n_teams in args.sizes:
+            results += bench_size(n_teams, work_dir, args.repeats, args.render_teams)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "versions": versions(),
+        "settings": {"repeats": args.repeats, "render_teams": args.render_teams},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to "+args.output, file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import io
+import sys
+import json
+import time
+import hashlib
+import importlib
+import argparse
+import threading
+import collections
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pizza_plots
+
+# A small HTTP service rendering one team's pizza chart on demand.
+# The feature table, league summary, fonts and logos stay loaded, renders run in a bounded pool of worker
+# processes that reuse their chart templates, and rendered bytes are kept in an LRU cache.
+#
+#   GET /chart/<team>/<chart>.<format>?dpi=200&percentiles=1   team by csv name or file name
+#   GET /health
+#   GET /metrics                                               stage timings and cache counters as json
+
+CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+MIN_DPI, MAX_DPI = 50, 400
+
+# Feature table, league summary, team lookup and dataset version, replaced when a source csv file changes
+_data = {}
+_data_lock = threading.Lock()
+
+# Rendered chart bytes by (team, chart, dataset version, dpi, format, percentiles), least recently used first
+_rendered = collections.OrderedDict()
+_rendered_bytes = 0
+# Renders still running, so concurrent requests for the same chart wait on the first request's render
+_in_flight = {}
+_rendered_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "renders": 0, "rejected": 0, "evicted": 0}
+
+# Server settings and the render pool, filled in by start()
+_settings = {"cache_bytes": 256*1024*1024, "cache_path": None, "render_slots": None}
+_executor = None
+
+# Version of the dataset: a hash of the source files' paths, modification times and sizes
+def dataset_version():
+    signature = pizza_plots.source_signature(
+        [pizza_plots.source_path(file_name) for file_name in pizza_plots.SOURCE_FILES])
+    return hashlib.sha1(json.dumps(signature).encode()).hexdigest()[:12]
+
+# The warm feature table, league summary and team lookup, rebuilt only when the dataset version changes
+# Teams are looked up by csv name or file name, giving (name, file name, row in the feature table)
+def current_data():
+    global _data
+    version = dataset_version()
+    with _data_lock:
+        if _data.get("version") != version:
+            play_styles_df = pizza_plots.playstyles_data(_settings["cache_path"])
+            names, file_names = pizza_plots.select_teams(play_styles_df)
+            teams = {}
+            for row, (name, file_name) in enumerate(zip(names, file_names)):
+                teams[file_name] = teams[name] = (name, file_name, row)
+            _data = {"version": version, "features": play_styles_df, "teams": teams,
+                     "summary": pizza_plots.league_summary(play_styles_df), "chart_data": {}}
+        return _data
+
+# Values, league medians and slice ranges of a chart type for every team, computed once per dataset version
+def chart_data(data, chart, percentiles):
+    with _data_lock:
+        key = (chart, percentiles)
+        if key not in data["chart_data"]:
+            data["chart_data"][key] = pizza_plots.chart_data(pizza_plots.CHART_SPECS[chart], data["features"],
+                                                             data["summary"], percentiles)
+        return data["chart_data"][key]
+
+# Load fonts and logos in a worker process, so its first request does not pay for them
+def warm_worker(file_names):
+    importlib.import_module("mplsoccer")
+    pizza_plots.warm_resources(file_names, download=False)
+
+# Render a job into memory in a worker process, reusing the worker's open chart templates,
+# and return the bytes with the stage timings the worker took for it
+def render_bytes(job):
+    buffer = io.BytesIO()
+    report, worker_metrics = pizza_plots.render_job_with_metrics(dict(job, path=buffer))
+    team, chart, _, error, _ = report
+    if error is not None:
+        raise RuntimeError("%s %s: %s" % (team, chart, error))
+    return buffer.getvalue(), worker_metrics
+
+# Keep rendered bytes in the LRU cache, evicting the least recently used charts beyond the byte budget
+def store_chart(key, content):
+    global _rendered_bytes
+    with _rendered_lock:
+        _in_flight.pop(key, None)
+        if key in _rendered:
+            _rendered_bytes -= len(_rendered[key])
+        _rendered[key] = content
+        _rendered_bytes += len(content)
+        while _rendered_bytes > _settings["cache_bytes"] and len(_rendered) > 1:
+            _, evicted = _rendered.popitem(last=False)
+            _rendered_bytes -= len(evicted)
+            _counters["evicted"] += 1
+
+# Bytes of one team's chart, from the cache or rendered in the pool
+# Only the request that starts a render builds its job and stores the result; concurrent requests for the
+# same chart wait on it. Raises ValueError for an unknown team and OverflowError when every render slot is taken
+def chart_bytes(team, chart, fmt="png", dpi=200, percentiles=False):
+    data = current_data()
+    if team not in data["teams"]:
+        raise ValueError("Unknown team: "+team)
+    name, file_name, row = data["teams"][team]
+    key = (file_name, chart, data["version"], dpi, fmt, percentiles)
+    with _rendered_lock:
+        content = _rendered.get(key)
+        if content is not None:
+            _rendered.move_to_end(key)
+            _counters["hits"] += 1
+            return content
+        _counters["misses"] += 1
+        future = _in_flight.get(key)
+        if future is None:
+            if not _settings["render_slots"].acquire(blocking=False):
+                _counters["rejected"] += 1
+                raise OverflowError("Too many charts rendering")
+            _in_flight[key] = pending = Future()
+            _counters["renders"] += 1
+    if future is not None:
+        return future.result()
+
+    # requests waiting on this render are always answered, whether it succeeds or fails at any step
+    error = None
+    try:
+        job = pizza_plots.render_job_for(chart_data(data, chart, percentiles), row, name, file_name, chart,
+                                         fmt=fmt, dpi=dpi, percentiles=percentiles)
+        try:
+            content, worker_metrics = _executor.submit(render_bytes, job).result()
+        finally:
+            _settings["render_slots"].release()
+        pizza_plots.merge_metrics(worker_metrics)
+        store_chart(key, content)
+    except BaseException as e:
+        error = e
+        with _rendered_lock:
+            _in_flight.pop(key, None)
+        raise
+    finally:
+        if error is None:
+            pending.set_result(content)
+        else:
+            pending.set_exception(error)
+    return content
+
+def server_metrics():
+    with _rendered_lock:
+        cache = dict(_counters, entries=len(_rendered), bytes=_rendered_bytes, in_flight=len(_in_flight))
+    stages = pizza_plots.metrics()["stages"]
+    return {"version": _data.get("version"), "cache": cache, "stages": stages}
+
+class ChartRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if parts == ["health"]:
+            return self.send_body(200, b"ok", "text/plain")
+        if parts == ["metrics"]:
+            return self.send_body(200, json.dumps(server_metrics()).encode(), "application/json")
+        if len(parts) != 3 or parts[0] != "chart":
+            return self.send_error(404, "Expected /chart/<team>/<chart>.<format>")
+        chart, _, fmt = parts[2].partition(".")
+        fmt = fmt or "png"
+        query = parse_qs(url.query)
+        try:
+            dpi = int(query.get("dpi", ["200"])[0])
+        except ValueError:
+            dpi = 0
+        if chart not in pizza_plots.CHART_SPECS or fmt not in CONTENT_TYPES or not MIN_DPI <= dpi <= MAX_DPI:
+            return self.send_error(400, "Unknown chart, format or dpi out of range %d-%d" % (MIN_DPI, MAX_DPI))
+        percentiles = query.get("percentiles", ["0"])[0] in ("1", "true", "yes")
+        try:
+            with pizza_plots.timed("serve_chart"):
+                content = chart_bytes(parts[1], chart, fmt, dpi, percentiles)
+        except ValueError as e:
+            return self.send_error(404, str(e))
+        except OverflowError as e:
+            return self.send_error(503, str(e))
+        except Exception as e:
+            pizza_plots.logger.exception("Rendering %s failed", self.path)
+            return self.send_error(500, str(e))
+        self.send_body(200, content, CONTENT_TYPES[fmt])
+
+    def send_body(self, status, content, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pizza_plots.logger.info("%s %s", self.address_string(), format % args)
+
+# Load the data and resources, start the render pool and return a server ready for serve_forever()
+def start(host="127.0.0.1", port=8000, workers=2, queue=None, cache_mb=256, cache_path=None):
+    global _executor
+    pizza_plots.set_headless()
+    _settings.update(cache_bytes=cache_mb*1024*1024, cache_path=cache_path,
+                     render_slots=threading.BoundedSemaphore(queue or workers*4))
+    start_time = time.perf_counter()
+    file_names = sorted(set(file_name for _, file_name, _ in current_data()["teams"].values()))
+    _executor = ProcessPoolExecutor(max_workers=workers, initializer=pizza_plots.init_render_worker,
+                                    initargs=(pizza_plots.FONT_DIR, pizza_plots.LOGO_DIR))
+    for future in [_executor.submit(warm_worker, file_names) for _ in range(workers)]:
+        future.result()
+    pizza_plots.logger.info("Loaded %d teams and %d render workers in %.1fs", len(file_names), workers,
+                            time.perf_counter() - start_time)
+    return ThreadingHTTPServer((host, port), ChartRequestHandler)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve team pizza charts over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2, help="render processes; default 2")
+    parser.add_argument("--queue", type=int, help="renders running or waiting before requests get 503; default 4 per worker")
+    parser.add_argument("--cache-mb", type=int, default=256, help="memory for rendered charts; default 256")
+    parser.add_argument("--data-dir", default=pizza_plots.DATA_DIR, help="directory holding the source csv files")
+    parser.add_argument("--font-dir", default=pizza_plots.FONT_DIR, help="directory holding the Roboto fonts")
+    parser.add_argument("--logo-dir", default=pizza_plots.LOGO_DIR, help="directory holding the team logos")
+    parser.add_argument("--cache", metavar="DIR", help="feature store directory, see pizza_plots.py --cache")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args(argv)
+    pizza_plots.DATA_DIR, pizza_plots.FONT_DIR, pizza_plots.LOGO_DIR = args.data_dir, args.font_dir, args.logo_dir
+    server = start(args.host, args.port, args.workers, args.queue, args.cache_mb, args.cache)
+    pizza_plots.logger.info("Serving charts on http://%s:%d/chart/<team>/<chart>.png", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _executor.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
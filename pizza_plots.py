@@ -1,36 +1,452 @@
+import os
+import sys
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+import argparse
+import functools
+import contextlib
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from urllib.request import urlopen
-from PIL import Image
-from mplsoccer import PyPizza, add_image, FontManager
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-from sklearn.model_selection import ParameterGrid
-from sklearn.metrics import silhouette_score
+
+# matplotlib, mplsoccer and PIL are imported inside the functions that render charts,
+# so --help and data-only commands start without loading them
 
 # This script plots pizza charts detailing the primary and secondary playing style attributes of all teams in Premier League 2021-2022 season
 
 # This removes the 'SettingWithCopyWarning'
 pd.set_option('mode.chained_assignment', None)
 
-# Plot primary team styles (focused on passing and possession data)
-def plot_primary(dataframe, team_df, average_df, team_name):
-    font_normal = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Regular.ttf?raw=true"))
-    font_italic = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Italic.ttf?raw=true"))
-    font_bold = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Medium.ttf?raw=true"))
-    img = "img/"+team_name+".png"
-    team_logo = Image.open(img)
+# Directory holding the source csv files, and the csv files the feature table is built from
+DATA_DIR = "."
+# Csv file in the data directory mapping each team name to the file name of its logo and charts
+TEAMS_FILE = "teams.csv"
+SOURCE_FILES = ["passing_data.csv", "pass_types_data.csv", "possession_data.csv", "defensive_actions_data.csv",
+                "misc_data.csv", "goal_shot_creation_data.csv", "shooting_data.csv", "goalkeepers_adv.csv"]
+
+# Fonts are read from FONT_DIR, which warm_resources() fills from FONT_URL, and logos from LOGO_DIR
+FONT_DIR = "fonts"
+FONT_URL = "https://github.com/google/fonts/blob/main/apache/roboto/static/"
+# Seconds a font download may stall before it is abandoned
+FONT_TIMEOUT = 30
+FONTS = {"normal": "Roboto-Regular.ttf", "italic": "Roboto-Italic.ttf", "bold": "Roboto-Medium.ttf"}
+# DejaVu fonts bundled with matplotlib, used when a Roboto font is not available locally
+FALLBACK_FONTS = {"normal": "DejaVuSans.ttf", "italic": "DejaVuSans-Oblique.ttf", "bold": "DejaVuSans-Bold.ttf"}
+LOGO_DIR = "img"
+# Where rendered charts are written by default
+OUTPUT_DIR = "PlayStyles"
+
+# League and season of the data in DATA_DIR, shown in the chart subtitles
+LEAGUE = "Premier League"
+SEASON = "2021-22"
+# Root directory of the feature stores of registered datasets
+STORE_DIR = "feature_store"
+# Registered datasets keyed by (league, season), see register_dataset()
+DATASETS = {}
+
+# When True charts are only saved, never shown, see set_headless()
+HEADLESS = False
+
+# Parsed csv files and the merged feature table, invalidated when a source file changes on disk
+_csv_cache = {}
+_features_cache = {}
+
+logger = logging.getLogger("pizza_plots")
+
+# Stage timings, per-team counters, per-team memory growth and profiler summaries collected by timed(),
+# record_rss() and profiled(), see metrics()
+_metrics = {"stages": {}, "teams": {}, "memory": {}, "profiles": {}}
+# Metrics may be recorded and read from several threads, as in chart_server.py
+_metrics_lock = threading.RLock()
+# Environment variable holding the profilers profiled() runs, comma separated: cprofile, tracemalloc
+PROFILE_ENV = "PIZZA_PROFILE"
+# Environment variable naming a directory that cProfile stats are dumped to, for snakeviz or pstats
+PROFILE_DIR_ENV = "PIZZA_PROFILE_DIR"
+# Name of the outermost profiled() block running, so nested blocks do not start a second profiler
+_profiling = None
+
+# Add one timing of a stage to the metrics, and to the team's counters when a team is given
+def record_stage(stage, seconds, team=None):
+    with _metrics_lock:
+        add_stage(stage, seconds, team)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({"event": "stage", "stage": stage, "team": team, "seconds": seconds}))
+
+def add_stage(stage, seconds, team):
+    totals = _metrics["stages"].setdefault(stage, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+    totals["calls"] += 1
+    totals["total_s"] += seconds
+    totals["max_s"] = max(totals["max_s"], seconds)
+    if team is not None:
+        counters = _metrics["teams"].setdefault(team, {}).setdefault(stage, {"calls": 0, "total_s": 0.0})
+        counters["calls"] += 1
+        counters["total_s"] += seconds
+
+# Add the RSS growth of one render, measured from rss_kb() taken before it, to the team's memory counters
+# Returns the growth in kilobytes, or None where RSS is unavailable
+def record_rss(team, before):
+    after = rss_kb()
+    if before is None or after is None:
+        return None
+    with _metrics_lock:
+        memory = _metrics["memory"].setdefault(team, {"renders": 0, "rss_growth_kb": 0, "rss_kb": 0})
+        memory["renders"] += 1
+        memory["rss_growth_kb"] += after - before
+        memory["rss_kb"] = after
+    return after - before
+
+# Time the enclosed block as one call of a stage
+@contextlib.contextmanager
+def timed(stage, team=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, team)
+
+# Run the enclosed block under cProfile and/or tracemalloc when PIZZA_PROFILE asks for them,
+# keeping the top functions by cumulative time and the top allocation sites under metrics()["profiles"][name]
+@contextlib.contextmanager
+def profiled(name, top=15):
+    global _profiling
+    profilers = [p.strip() for p in os.environ.get(PROFILE_ENV, "").lower().split(",") if p.strip()]
+    if not profilers or _profiling is not None:
+        yield
+        return
+    import tracemalloc
+    profile = None
+    if "cprofile" in profilers:
+        import cProfile
+        profile = cProfile.Profile()
+    trace = "tracemalloc" in profilers and not tracemalloc.is_tracing()
+    _profiling = name
+    if trace:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        result = {}
+        if profile is not None:
+            profile.disable()
+            import pstats
+            stats = pstats.Stats(profile)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            result["cprofile"] = [{"function": "%s:%d(%s)" % function, "calls": calls, "total_s": total_s,
+                                   "cumulative_s": cumulative_s}
+                                  for function, (_, calls, total_s, cumulative_s, _) in rows]
+            profile_dir = os.environ.get(PROFILE_DIR_ENV)
+            if profile_dir:
+                os.makedirs(profile_dir, exist_ok=True)
+                stats.dump_stats(os.path.join(profile_dir, name+".prof"))
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            sites = tracemalloc.take_snapshot().statistics("lineno")[:top]
+            tracemalloc.stop()
+            result["tracemalloc"] = {"peak_kb": peak // 1024,
+                                     "top": [{"location": str(site.traceback), "size_kb": site.size // 1024,
+                                              "count": site.count} for site in sites]}
+        with _metrics_lock:
+            _metrics["profiles"][name] = result
+        _profiling = None
+        logger.info(json.dumps({"event": "profile", "name": name, "profile": result}))
+
+# A copy of the collected stage timings, per-team counters and profiles
+def metrics():
+    with _metrics_lock:
+        return copy.deepcopy(_metrics)
+
+def reset_metrics():
+    with _metrics_lock:
+        for values in _metrics.values():
+            values.clear()
+
+# Add metrics collected elsewhere, such as in a render worker process, to this process's metrics
+def merge_metrics(other):
+    with _metrics_lock:
+        for stage, totals in other["stages"].items():
+            merged = _metrics["stages"].setdefault(stage, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+            merged["calls"] += totals["calls"]
+            merged["total_s"] += totals["total_s"]
+            merged["max_s"] = max(merged["max_s"], totals["max_s"])
+        for team, stages in other["teams"].items():
+            for stage, counters in stages.items():
+                merged = _metrics["teams"].setdefault(team, {}).setdefault(stage, {"calls": 0, "total_s": 0.0})
+                merged["calls"] += counters["calls"]
+                merged["total_s"] += counters["total_s"]
+        for team, memory in other["memory"].items():
+            merged = _metrics["memory"].setdefault(team, {"renders": 0, "rss_growth_kb": 0, "rss_kb": 0})
+            merged["renders"] += memory["renders"]
+            merged["rss_growth_kb"] += memory["rss_growth_kb"]
+            merged["rss_kb"] = memory["rss_kb"]
+        _metrics["profiles"].update(other["profiles"])
+
+# Emit the collected metrics as one structured log record
+def log_metrics(level=logging.INFO):
+    logger.log(level, json.dumps({"event": "metrics", "metrics": metrics()}))
+
+# Identify a set of source files by path, modification time and size
+def source_signature(file_names):
+    signature = []
+    for file_name in file_names:
+        stat = os.stat(file_name)
+        signature.append((os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def source_path(file_name, data_dir=None):
+    return os.path.join(data_dir or DATA_DIR, file_name)
+
+# Parse a source csv file, whose counts may have thousands separators
+def parse_source(path):
+    with timed("load_csv"):
+        return pd.read_csv(path, thousands=",", skipinitialspace=True)
+
+# Read a csv file from DATA_DIR, or data_dir, once and reuse the parsed frame until the file changes
+def read_source(file_name, data_dir=None):
+    path = source_path(file_name, data_dir)
+    key = source_signature([path])[0]
+    if key not in _csv_cache:
+        for cached_key in [k for k in _csv_cache if k[0] == key[0]]:
+            del _csv_cache[cached_key]
+        _csv_cache[key] = parse_source(path)
+    return _csv_cache[key].copy()
+
+# A source frame from a mapping of file name to frame when one is given, otherwise read from DATA_DIR
+def source_frame(file_name, sources=None):
+    if sources is not None:
+        return sources[file_name].copy()
+    return read_source(file_name)
+
+# Drop every cached csv file and feature table
+def clear_cache():
+    _csv_cache.clear()
+    _features_cache.clear()
+
+# Font properties are built once per font file
+@functools.lru_cache(maxsize=None)
+def load_font(path):
+    from matplotlib.font_manager import FontProperties
+    with timed("load_font"):
+        return FontProperties(fname=path)
+
+# Whether a font file can be opened by FreeType, so a damaged download is skipped rather than failing every render
+@functools.lru_cache(maxsize=None)
+def font_readable(path):
+    from matplotlib.ft2font import FT2Font
+    try:
+        FT2Font(path)
+    except (OSError, RuntimeError, ValueError):
+        return False
+    return True
+
+# Resolve a chart font from FONT_DIR, falling back to matplotlib's bundled DejaVu font, without any network access
+def get_font(style):
+    path = os.path.join(FONT_DIR, FONTS[style])
+    if not os.path.exists(path) or not font_readable(path):
+        import matplotlib
+        path = os.path.join(matplotlib.get_data_path(), "fonts", "ttf", FALLBACK_FONTS[style])
+    return load_font(path)
+
+# Team logos are decoded once and kept in an LRU map
+@functools.lru_cache(maxsize=64)
+def load_logo(path):
+    from PIL import Image
+    from matplotlib.image import pil_to_array
+    with timed("load_logo"), Image.open(path) as img:
+        logo = pil_to_array(img)
+    logo.flags.writeable = False
+    return logo
+
+def get_logo(team_name):
+    return load_logo(os.path.join(LOGO_DIR, team_name+".png"))
+
+# Download a font into FONT_DIR through a temporary file, so an interrupted download never leaves a truncated font
+def download_font(file_name):
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(dir=FONT_DIR, prefix=file_name, suffix=".part")
+    try:
+        with timed("fetch_font"), urlopen(FONT_URL+file_name+"?raw=true", timeout=FONT_TIMEOUT) as response, \
+                os.fdopen(fd, "wb") as f:
+            f.write(response.read())
+        os.replace(temp_path, os.path.join(FONT_DIR, file_name))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+# Download any missing fonts into FONT_DIR and load fonts and logos, so later renders make no network calls
+def warm_resources(team_names=(), download=True):
+    if download:
+        os.makedirs(FONT_DIR, exist_ok=True)
+        for file_name in FONTS.values():
+            if not os.path.exists(os.path.join(FONT_DIR, file_name)):
+                download_font(file_name)
+    for style in FONTS:
+        get_font(style)
+    for team_name in team_names:
+        get_logo(team_name)
+
+# Switch to the non-interactive Agg backend so charts are saved without opening a window
+def set_headless():
+    global HEADLESS
+    HEADLESS = True
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+# Peak resident set size of this process in kilobytes, or None where the resource module is unavailable
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    if os.uname().sysname == "Darwin":
+        peak = peak // 1024
+    return peak
+
+# Current resident set size of this process in kilobytes, read from /proc where it exists,
+# otherwise the all-time peak from peak_rss_kb()
+def rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_kb()
+
+# Default output path of a team's chart
+def chart_path(team_name, chart, output_dir=None, fmt="png"):
+    return os.path.join(output_dir or OUTPUT_DIR, team_name+'_'+chart+'.'+fmt)
+
+# Write a figure to a path or a caller-supplied file object, returning the path, the bytes written when the
+# buffer has getvalue() (io.BytesIO), or None for other file objects
+# The format is taken from the path's extension unless fmt is given
+def write_chart(fig, output, dpi=200, fmt=None):
+    if isinstance(output, str):
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    fig.savefig(output, format=fmt, pad_inches = 0.2, dpi=dpi, facecolor='#111111')
+    if isinstance(output, str):
+        return output
+    if hasattr(output, "getvalue"):
+        return output.getvalue()
+    return None
+
+# Save a finished chart, then close its figure so batch runs stay in flat memory
+def save_chart(fig, output, show=None, dpi=200, fmt=None):
+    import matplotlib.pyplot as plt
+    result = write_chart(fig, output, dpi, fmt)
+    if show is None:
+        show = not HEADLESS
+    if show:
+        plt.show()
+    plt.close(fig)
+    return result
+
+# Where the team logo sits in the middle of the pizza
+LOGO_POSITION = dict(left=0.4478, bottom=0.4315, width=0.13, height=0.127)
+
+# Chart types: subtitles for value and percentile charts and, for each parameter, (label, column, min padding, max padding, slice colour)
+# The range of a slice is the league min/max of its column widened by its paddings
+CHART_SPECS = {
+    "primary": {
+        "subtitle": "Primary Attributes vs League Median | Season {season}",
+        "percentile_subtitle": "Primary Attributes as League Percentiles | Season {season}",
+        "params": [
+            ("Long Passes %", "long_attem%", 5, 2, "#227c9d"),
+            ("Medium Passes %", "medium_attem%", 5, 2, "#227c9d"),
+            ("Short Passes %", "short_attem%", 5, 2, "#227c9d"),
+            ("Ground Passes %", "ground%", 5, 2, "#17c3b2"),
+            ("Low Passes %", "low%", 5, 2, "#17c3b2"),
+            ("High Passes %", "high%", 5, 2, "#17c3b2"),
+            ("Possession %", "possession", 5, 2, "#ffcb77"),
+            ("Directness", "prog_distance%", 5, 2, "#fef9ef"),
+        ],
+    },
+    "secondary": {
+        "subtitle": "Secondary Attributes vs League Median | Season {season}",
+        "percentile_subtitle": "Secondary Attributes as League Percentiles | Season {season}",
+        "params": [
+            ("Attacking Pressures p90", "press_att_p90", 5, 2, "#005f73"),
+            ("Cross %", "cross%", 1, 0.5, "#0a9396"),
+            ("Physicality Rating", "physicality", 5, 2, "#94d2bd"),
+            ("Set Piece Chances", "dead_balls%", 5, 2, "#ee9b00"),
+            ("NP Goals-xG", "np_goals-xG", 5, 2, "#ca6702"),
+            ("GK Long Pass %", "long%", 5, 2, "#ae2012"),
+        ],
+    },
+}
+
+# Columns plotted by a chart spec
+def spec_columns(spec):
+    return [param[1] for param in spec["params"]]
+
+# Columns plotted by any chart, in chart order
+def charted_columns():
+    columns = []
+    for spec in CHART_SPECS.values():
+        columns += [column for column in spec_columns(spec) if column not in columns]
+    return columns
 
-    params = ['Long Passes %', 'Medium Passes %', 'Short Passes %', 'Ground Passes %', 'Low Passes %', 'High Passes %', 'Possession %', 'Directness']
-    values = [team_df["long_attem%"].iloc[0], team_df["medium_attem%"].iloc[0], team_df["short_attem%"].iloc[0], team_df["ground%"].iloc[0], team_df["low%"].iloc[0], team_df["high%"].iloc[0], team_df["possession"].iloc[0], team_df["prog_distance%"].iloc[0]]
-    values2 = [average_df["long_attem%"].iloc[0], average_df["medium_attem%"].iloc[0], average_df["short_attem%"].iloc[0], average_df["ground%"].iloc[0], average_df["low%"].iloc[0], average_df["high%"].iloc[0], average_df["possession"].iloc[0], average_df["prog_distance%"].iloc[0]]
+# League medians and padded slice ranges of a chart, read from a league summary
+def chart_ranges(spec, summary):
+    compare_values = np.array([summary["median"][param[1]] for param in spec["params"]])
+    min_range = np.array([summary["min"][param[1]] - param[2] for param in spec["params"]])
+    max_range = np.array([summary["max"][param[1]] + param[3] for param in spec["params"]])
+    return compare_values, min_range, max_range
 
-    min_range = [dataframe["long_attem%"].min()-5, dataframe["medium_attem%"].min()-5, dataframe["short_attem%"].min()-5, dataframe["ground%"].min()-5, dataframe["low%"].min()-5, dataframe["high%"].min()-5, dataframe["possession"].min()-5, dataframe["prog_distance%"].min()-5]
-    max_range = [dataframe["long_attem%"].max()+2, dataframe["medium_attem%"].max()+2, dataframe["short_attem%"].max()+2, dataframe["ground%"].max()+2, dataframe["low%"].max()+2, dataframe["high%"].max()+2, dataframe["possession"].max()+2, dataframe["prog_distance%"].max()+2]
+# League percentile of every team for each column, from one rank over the whole feature matrix
+# A missing value, such as a 0/0 ratio, stays missing (Int64 NA) and does not affect the other teams' ranks
+def percentile_ranks(play_styles_df, columns=None):
+    if columns is None:
+        columns = charted_columns()
+    return (play_styles_df[columns].rank(pct=True, na_option="keep")*100).round().astype("Int64")
 
-    slice_colors = ["#227c9d"] * 3 + ["#17c3b2"] * 3 + ["#ffcb77"] + ["#fef9ef"]
+# A chart spec with the subtitle filled in for a season, using the percentile subtitle when the chart shows percentiles
+def chart_spec(chart, percentiles=False, season=None):
+    spec = CHART_SPECS[chart]
+    subtitle = spec["percentile_subtitle"] if percentiles else spec["subtitle"]
+    return dict(spec, subtitle=subtitle.format(season=season or SEASON))
+
+# Gather the values of every team in one pass over the feature table, with the medians and slice ranges of a chart
+# With percentiles, values are league percentiles plotted from 0 to 100 against the 50th percentile
+def chart_data(spec, play_styles_df, summary, percentiles=False):
+    if percentiles:
+        size = len(spec["params"])
+        ranks = percentile_ranks(play_styles_df, spec_columns(spec))
+        if ranks.isna().any(axis=None):
+            values = ranks.to_numpy(dtype=object, na_value=np.nan)
+        else:
+            values = ranks.to_numpy(dtype=int)
+        return {
+            "teams": play_styles_df["team"].to_list(),
+            "values": values,
+            "compare_values": np.full(size, 50),
+            "min_range": np.zeros(size),
+            "max_range": np.full(size, 100),
+        }
+    compare_values, min_range, max_range = chart_ranges(spec, summary)
+    return {
+        "teams": play_styles_df["team"].to_list(),
+        "values": play_styles_df[spec_columns(spec)].to_numpy(),
+        "compare_values": compare_values,
+        "min_range": min_range,
+        "max_range": max_range,
+    }
+
+# Draw a team's chart from a spec into a new figure and return the artists a template needs to update it
+def draw_chart(spec, values, compare_values, min_range, max_range, team_name):
+    from mplsoccer import PyPizza, add_image
+    font_normal = get_font("normal")
+    font_italic = get_font("italic")
+    font_bold = get_font("bold")
+    team_logo = get_logo(team_name)
+
+    params = [param[0] for param in spec["params"]]
+    slice_colors = [param[4] for param in spec["params"]]
 
     pizza = PyPizza(
         params=params,                  # list of parameters
@@ -47,7 +463,7 @@ def plot_primary(dataframe, team_df, average_df, team_name):
 
     fig, ax = pizza.make_pizza(
     values,              # list of values
-    compare_values=values2,    # passing comparison values
+    compare_values=compare_values,    # passing comparison values
     figsize=(8, 8),      # adjust figsize according to your need
     slice_colors=slice_colors,       # color for individual slices
     color_blank_space="same",   # use same color to fill blank space
@@ -61,11 +477,11 @@ def plot_primary(dataframe, team_df, average_df, team_name):
     ),                          # values to be used when plotting comparison slices
     kwargs_params=dict(
         color="white", fontsize=12,
-        fontproperties=font_normal.prop, va="center"
+        fontproperties=font_normal, va="center"
     ),                   # values to be used when adding parameter
     kwargs_values=dict(
         color="white", fontsize=12,
-        fontproperties=font_normal.prop, zorder=3,
+        fontproperties=font_normal, zorder=3,
         bbox=dict(
             edgecolor="#000000", facecolor="black",
             boxstyle="round,pad=0.2", lw=1
@@ -73,7 +489,7 @@ def plot_primary(dataframe, team_df, average_df, team_name):
     ),                   # values to be used when adding parameter-values
     kwargs_compare_values=dict(
         color="none", fontsize=0,
-        fontproperties=font_normal.prop, zorder=3,
+        fontproperties=font_normal, zorder=3,
         bbox=dict(
             edgecolor="none", facecolor="none",
             boxstyle="round,pad=0.2", lw=0
@@ -81,16 +497,16 @@ def plot_primary(dataframe, team_df, average_df, team_name):
     )                   # values to be used when adding comparison-values
     )
     # add title
-    fig.text(
+    title = fig.text(
         0.515, 0.97, team_name+" FC", size=18,
-        ha="center", fontproperties=font_bold.prop, color="white"
+        ha="center", fontproperties=font_bold, color="white"
     )
     # add subtitle
     fig.text(
         0.515, 0.942,
-        "Primary Attributes vs League Median | Season 2021-22",
+        spec["subtitle"],
         size=15,
-        ha="center", fontproperties=font_bold.prop, color="white"
+        ha="center", fontproperties=font_bold, color="white"
     )
     # add credits
     CREDIT_1 = "data: statsbomb viz fbref"
@@ -98,254 +514,191 @@ def plot_primary(dataframe, team_df, average_df, team_name):
 
     fig.text(
         0.99, 0.005, f"{CREDIT_1}\n{CREDIT_2}", size=9,
-        fontproperties=font_italic.prop, color="white",
+        fontproperties=font_italic, color="white",
         ha="right"
     )
     # add image
     ax_image = add_image(
-        team_logo, fig, left=0.4478, bottom=0.4315, width=0.13, height=0.127
+        team_logo, fig, **LOGO_POSITION
     )   # these values might differ when you are plotting
 
-    plt.savefig('PlayStyles/'+team_name+'_primary.png', pad_inches = 0.2, dpi=200, facecolor='#111111')
-    plt.show()
+    return {"fig": fig, "ax": ax, "pizza": pizza, "title": title, "logo_ax": ax_image, "compare_values": compare_values}
+
+# Plot a chart type for one team into a new figure, save it and close it
+# The RSS growth of the render is added to the team's memory counters in metrics()
+def plot_chart(chart, values, compare_values, min_range, max_range, team_name, output=None, show=None, dpi=200, fmt=None):
+    rss_before = rss_kb()
+    with timed("draw_chart", team_name):
+        chart_parts = draw_chart(chart_spec(chart), values, compare_values, min_range, max_range, team_name)
+    if output is None:
+        output = chart_path(team_name, chart, fmt=fmt or "png")
+    with timed("savefig", team_name):
+        result = save_chart(chart_parts["fig"], output, show, dpi, fmt)
+    record_rss(team_name, rss_before)
+    return result
+
+# Plot a chart type for the team in team_df against a league summary
+def plot_team_chart(chart, summary, team_df, team_name, output=None, show=None):
+    spec = CHART_SPECS[chart]
+    compare_values, min_range, max_range = chart_ranges(spec, summary)
+    values = team_df[spec_columns(spec)].to_numpy()[0]
+    with timed("plot_"+chart, team_name):
+        return plot_chart(chart, values, compare_values, min_range, max_range, team_name, output, show)
+
+# Plot primary team styles (focused on passing and possession data)
+def plot_primary(summary, team_df, team_name, output=None, show=None):
+    return plot_team_chart("primary", summary, team_df, team_name, output, show)
 
 # Plot secondary team styles
-def plot_secondary(dataframe, team_df, average_df, team_name):
-    font_normal = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Regular.ttf?raw=true"))
-    font_italic = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Italic.ttf?raw=true"))
-    font_bold = FontManager(("https://github.com/google/fonts/blob/main/apache/roboto/static/Roboto-Medium.ttf?raw=true"))
-    img = "img/"+team_name+".png"
-    team_logo = Image.open(img)
+def plot_secondary(summary, team_df, team_name, output=None, show=None):
+    return plot_team_chart("secondary", summary, team_df, team_name, output, show)
 
-    params = ['Attacking Pressures p90', 'Cross %', 'Physicality Rating', 'Set Piece Chances', 'NP Goals-xG', 'GK Long Pass %']
-    values = [team_df["press_att_p90"].iloc[0], team_df["cross%"].iloc[0], team_df["physicality"].iloc[0], team_df["dead_balls%"].iloc[0], team_df["np_goals-xG"].iloc[0], team_df["long%"].iloc[0]]
-    values2 = [average_df["press_att_p90"].iloc[0], average_df["cross%"].iloc[0], average_df["physicality"].iloc[0], average_df["dead_balls%"].iloc[0], average_df["np_goals-xG"].iloc[0], average_df["long%"].iloc[0]]
+# One open chart per chart type, reused for every team while the league medians and ranges stay the same
+_templates = {}
 
-    min_range = [dataframe["press_att_p90"].min()-5, dataframe["cross%"].min()-1, dataframe["physicality"].min()-5, dataframe["dead_balls%"].min()-5, dataframe["np_goals-xG"].min()-5, dataframe["long%"].min()-5]
-    max_range = [dataframe["press_att_p90"].max()+2, dataframe["cross%"].max()+0.5, dataframe["physicality"].max()+2, dataframe["dead_balls%"].max()+2, dataframe["np_goals-xG"].max()+2, dataframe["long%"].max()+2]
+# Scale values onto slice heights between 0 and 100, as PyPizza does when ranges are given
+def scale_values(values, min_range, max_range):
+    values_clipped = np.clip(values, np.minimum(min_range, max_range), np.maximum(min_range, max_range))
+    return np.abs(values_clipped-min_range)/np.abs(max_range-min_range)*100
 
-    slice_colors = ["#005f73"] + ["#0a9396"] + ["#94d2bd"] + ["#ee9b00"] + ["#ca6702"] + ["#ae2012"]
+# Point an open chart at another team: only the slices, value labels, title and logo change
+def update_chart(chart_parts, values, team_name):
+    from mplsoccer import add_image
+    pizza = chart_parts["pizza"]
+    heights = scale_values(values, pizza.min_range, pizza.max_range)
+    compare_heights = scale_values(chart_parts["compare_values"], pizza.min_range, pizza.max_range)
+    main_slice, compare_slice = chart_parts["ax"].containers[0], chart_parts["ax"].containers[2]
+    for i, (slice_m, slice_c) in enumerate(zip(main_slice, compare_slice)):
+        slice_m.set_height(heights[i])
+        if heights[i] <= compare_heights[i]:
+            slice_c.set_zorder(slice_m.get_zorder() - 0.1)
+        else:
+            slice_c.set_zorder(slice_m.get_zorder() + 0.1)
+    for text, theta, value, height in zip(pizza.get_value_texts(), pizza.get_theta(), values, heights):
+        text.set_text(value)
+        text.set_position((theta, height))
+    chart_parts["title"].set_text(team_name+" FC")
+    chart_parts["logo_ax"].remove()
+    chart_parts["logo_ax"] = add_image(get_logo(team_name), chart_parts["fig"], **LOGO_POSITION)
 
-    pizza = PyPizza(
-        params=params,                  # list of parameters
-        background_color="#111111",     # background color
-        min_range = min_range,
-        max_range = max_range,
-        straight_line_color="#000000",  # color for straight lines
-        straight_line_lw=1,             # linewidth for straight lines
-        last_circle_lw=0,               # linewidth of last circle
-        inner_circle_size=10,            # increase the circle size
-        other_circle_lw=0,             # linewidth for other circles
-        #other_circle_ls="-."            # linestyle for other circles
-        )
+# Plot a team's chart by updating the open template for that chart type, then save it without closing the figure
+def plot_from_template(chart, values, compare_values, min_range, max_range, team_name, output, dpi=200, fmt=None,
+                       percentiles=False, season=None):
+    import matplotlib.pyplot as plt
+    key = (percentiles, season, tuple(compare_values), tuple(min_range), tuple(max_range))
+    template = _templates.get(chart)
+    if template is None or template[0] != key:
+        if template is not None:
+            plt.close(template[1]["fig"])
+        with timed("draw_chart", team_name):
+            chart_parts = draw_chart(chart_spec(chart, percentiles, season), values, compare_values, min_range, max_range, team_name)
+        _templates[chart] = (key, chart_parts)
+    else:
+        chart_parts = template[1]
+        with timed("update_chart", team_name):
+            update_chart(chart_parts, values, team_name)
+    with timed("savefig", team_name):
+        return write_chart(chart_parts["fig"], output, dpi, fmt)
 
-    fig, ax = pizza.make_pizza(
-    values,              # list of values
-    compare_values=values2,    # passing comparison values
-    figsize=(8, 8),      # adjust figsize according to your need
-    slice_colors=slice_colors,       # color for individual slices
-    color_blank_space="same",   # use same color to fill blank space
-    #blank_alpha=0.4,                 # alpha for blank-space colors
-    param_location=105,  # where the parameters will be added
-    kwargs_slices=dict(
-        edgecolor="#000000", zorder=2, linewidth=1
-    ),                   # values to be used when plotting slices
-    kwargs_compare=dict(
-        facecolor="none", edgecolor="#000000", zorder=3, linewidth=1,
-    ),                          # values to be used when plotting comparison slices
-    kwargs_params=dict(
-        color="white", fontsize=12,
-        fontproperties=font_normal.prop, va="center"
-    ),                   # values to be used when adding parameter
-    kwargs_values=dict(
-        color="white", fontsize=12,
-        fontproperties=font_normal.prop, zorder=3,
-        bbox=dict(
-            edgecolor="#000000", facecolor="black",
-            boxstyle="round,pad=0.2", lw=1
-            )
-    ),                   # values to be used when adding parameter-values
-    kwargs_compare_values=dict(
-        color="none", fontsize=0,
-        fontproperties=font_normal.prop, zorder=3,
-        bbox=dict(
-            edgecolor="none", facecolor="none",
-            boxstyle="round,pad=0.2", lw=0
-        )
-    )                   # values to be used when adding comparison-values
-    )
-    # add title
-    fig.text(
-        0.515, 0.97, team_name+" FC", size=18,
-        ha="center", fontproperties=font_bold.prop, color="white"
-    )
-    # add subtitle
-    fig.text(
-        0.515, 0.942,
-        "Secondary Attributes vs League Median | Season 2021-22",
-        size=15,
-        ha="center", fontproperties=font_bold.prop, color="white"
-    )
-    # add credits
-    CREDIT_1 = "data: statsbomb viz fbref"
-    CREDIT_2 = "YOUR_NAME"
 
-    fig.text(
-        0.99, 0.005, f"{CREDIT_1}\n{CREDIT_2}", size=9,
-        fontproperties=font_italic.prop, color="white",
-        ha="right"
-    )
-    # add image
-    ax_image = add_image(
-        team_logo, fig, left=0.4478, bottom=0.4315, width=0.13, height=0.127
-    )   # these values might differ when you are plotting
+# Round an array the same way as the builtin round(), which np.round() can miss on near half-way values
+def round_values(values, decimals):
+    rounded = np.round(values, decimals)
+    shifted = values*10**decimals
+    near_half = np.abs(shifted-np.floor(shifted)-0.5) < 1e-6
+    for i in np.flatnonzero(near_half):
+        rounded[i] = round(float(values[i]), decimals)
+    return rounded
 
-    plt.savefig('PlayStyles/'+team_name+'_secondary.png', pad_inches = 0.2, dpi=200, facecolor='#111111')
-    plt.show()
-
-def pass_distance():
-    df = pd.read_csv("passing_data.csv")
-    passing_types_df = df[['team', 'completed', 'attempted', 'completion%', 'total_distance', 'prog_distance',
-                    'short_completed', 'short_attem','short_comp%', 'med_completed', 'medium_attem', 'medium_comp%',
-                    'long_completed', 'long_attem', 'long_comp%']]
-    passes_short_perc = []
-    passes_medium_perc = []
-    passes_long_perc = []
-    for index, row in passing_types_df.iterrows():
-        total_passes_att = row.short_attem+row.medium_attem+row.long_attem
-        num = (row.short_attem/total_passes_att)*100
-        passes_short_perc.append(round(num, 1))
-        num = (row.medium_attem/total_passes_att)*100
-        passes_medium_perc.append(round(num, 1))
-        num = (row.long_attem/total_passes_att)*100
-        passes_long_perc.append(round(num, 1))
-    passing_types_df["short_attem%"] = passes_short_perc
-    passing_types_df["medium_attem%"] = passes_medium_perc
-    passing_types_df["long_attem%"] = passes_long_perc
-    average_league_passes_short_perc = passing_types_df["short_attem%"].mean()
-    average_league_passes_medium_perc = passing_types_df["medium_attem%"].mean()
-    average_league_passes_long_perc = passing_types_df["long_attem%"].mean()
-    short_passes_ranked = passing_types_df.sort_values(by='short_attem%', ascending=False)
-    medium_passes_ranked = passing_types_df.sort_values(by='medium_attem%', ascending=False)
-    long_passes_ranked = passing_types_df.sort_values(by='long_attem%', ascending=False)
+# Ratio metrics as column expressions: (output column, numerator columns, denominator columns, scale, decimals, rounding)
+# Each one is evaluated over whole columns at once by compute_metrics(). Rounding is round_values() for ratios that
+# were rounded with the builtin round(), and np.round() for those rounded with DataFrame.round()
+METRICS = {
+    "pass_distance": [
+        ("short_attem%", ["short_attem"], ["short_attem", "medium_attem", "long_attem"], 100, 1, round_values),
+        ("medium_attem%", ["medium_attem"], ["short_attem", "medium_attem", "long_attem"], 100, 1, round_values),
+        ("long_attem%", ["long_attem"], ["short_attem", "medium_attem", "long_attem"], 100, 1, round_values),
+    ],
+    "pass_styles": [
+        ("ground%", ["ground"], ["attempted"], 100, 1, round_values),
+        ("low%", ["low"], ["attempted"], 100, 1, round_values),
+        ("high%", ["high"], ["attempted"], 100, 1, round_values),
+    ],
+    "possession_styles": [
+        ("prog_distance%", ["prog_distance"], ["total_distance"], 100, 1, round_values),
+        ("prog_passes%", ["prog_passes"], ["completed"], 100, 1, round_values),
+    ],
+    "high_press": [
+        ("press_att_p90", ["press_att"], ["90s"], 1, 1, np.round),
+    ],
+    "crossing": [
+        ("cross%", ["cross"], ["attempted"], 100, 1, round_values),
+    ],
+    "physicality": [
+        ("tackles_won%", ["tackles_won"], ["tackles"], 100, 1, round_values),
+    ],
+    "set_pieces": [
+        ("dead_balls%", ["dead_sca"], ["shot_cre_acts"], 100, 1, round_values),
+    ],
+}
+
+# Evaluate a list of ratio metrics over a dataframe and add them as new columns
+def compute_metrics(df, metrics):
+    for column, numerator, denominator, scale, decimals, rounding in metrics:
+        num = df[numerator].to_numpy(dtype=float).sum(axis=1)
+        den = df[denominator].to_numpy(dtype=float).sum(axis=1)
+        df[column] = rounding((num/den)*scale, decimals)
+    return df
+
+def pass_distance(sources=None):
+    df = source_frame("passing_data.csv", sources)
+    passing_types_df = compute_metrics(df, METRICS["pass_distance"])
     passing_types_df = passing_types_df[['team', 'long_attem%', 'medium_attem%', 'short_attem%']]
     return passing_types_df
 
-def pass_styles():
-    df = pd.read_csv("pass_types_data.csv")
-    passing_styles_df = df[['team', 'attempted', 'ground', 'low', 'high']]
-    passes_ground_perc = []
-    passes_low_perc = []
-    passes_high_perc = []
-    for index, row in passing_styles_df.iterrows():
-        num = (row.ground/row.attempted)*100
-        passes_ground_perc.append(round(num, 1))
-        num = (row.low/row.attempted)*100
-        passes_low_perc.append(round(num, 1))
-        num = (row.high/row.attempted)*100
-        passes_high_perc.append(round(num, 1))
-    passing_styles_df["ground%"] = passes_ground_perc
-    passing_styles_df["low%"] = passes_low_perc
-    passing_styles_df["high%"] = passes_high_perc
-    average_league_passes_ground_perc = passing_styles_df["ground%"].mean()
-    average_league_passes_low_perc = passing_styles_df["low%"].mean()
-    average_league_passes_high_perc = passing_styles_df["high%"].mean()
-    ground_passes_ranked = passing_styles_df.sort_values(by='ground%', ascending=False)
-    low_passes_ranked = passing_styles_df.sort_values(by='low%', ascending=False)
-    high_passes_ranked = passing_styles_df.sort_values(by='high%', ascending=False)
+def pass_styles(sources=None):
+    df = source_frame("pass_types_data.csv", sources)
+    passing_styles_df = compute_metrics(df, METRICS["pass_styles"])
     passing_styles_df = passing_styles_df[['team', 'ground%', 'low%', 'high%']]
     return passing_styles_df
 
-def possession_types():
-    df = pd.read_csv("possession_data.csv")
+def possession_types(sources=None):
+    df = source_frame("possession_data.csv", sources)
     possession_types_df = df[['team', 'possession']]
-    possession_types_df = possession_types_df.sort_values(by='possession', ascending=False)
-    possession_types = []
-    possession_score = []
-    for i in range(len(possession_types_df)):
-        if i < 6:
-            possession_types.append("high")
-            possession_score.append(4)
-        elif i >= 6 and i < 11:
-            possession_types.append("high-medium")
-            possession_score.append(3)
-        elif i >= 11 and i < 16:
-            possession_types.append("medium-low")
-            possession_score.append(2)
-        elif i >= 16:
-            possession_types.append("low")
-            possession_score.append(1)
-    possession_types_df["possession_type"] = possession_types
-    possession_types_df["possession_score"] = possession_score
+    # position in the league by possession, ties keep file order: the top 6 are high, the next 5 high-medium,
+    # the next 5 medium-low and the rest low
+    position = possession_types_df["possession"].rank(method="first", ascending=False).to_numpy() - 1
+    buckets = np.array(["high", "high-medium", "medium-low", "low"])
+    possession_types_df["possession_type"] = buckets[np.searchsorted([6, 11, 16], position, side="right")]
     average_league_possession = possession_types_df["possession"].mean()
     possession_types_df["possession_diff"] = possession_types_df["possession"]-average_league_possession
     possession_types_df = possession_types_df[['team', 'possession_type', 'possession', 'possession_diff']]
     return possession_types_df
 
-def possession_styles():
-    df = pd.read_csv("passing_data.csv")
-    possession_styles_df = df[['team', 'completed', 'attempted', 'total_distance', 'prog_distance', 'prog_passes']]
-    prog_distance_perc = []
-    prog_passes_perc = []
-    for index, row in possession_styles_df.iterrows():
-        num = (row.prog_distance/row.total_distance)*100
-        prog_distance_perc.append(round(num, 1))
-        num = (row.prog_passes/row.completed)*100
-        prog_passes_perc.append(round(num, 1))
-    possession_styles_df["prog_distance%"] = prog_distance_perc
-    possession_styles_df["prog_passes%"] = prog_passes_perc
-    average_league_prog_distance_perc = possession_styles_df["prog_distance%"].mean()
-    average_league_prog_passes_perc = possession_styles_df["prog_passes%"].mean()
-    prog_distance_ranked = possession_styles_df.sort_values(by='prog_distance%', ascending=False)
-    prog_passes_ranked = possession_styles_df.sort_values(by='prog_passes%', ascending=False)
+def possession_styles(sources=None):
+    df = source_frame("passing_data.csv", sources)
+    possession_styles_df = compute_metrics(df, METRICS["possession_styles"])
     possession_styles_df = possession_styles_df[['team', 'prog_distance%', 'prog_passes%']]
     return possession_styles_df
 
-def high_press():
-    df = pd.read_csv("defensive_actions_data.csv")
-    high_press_df = df[['team','90s', 'pressures', 'press_succ', 'press_succ%', 'press_def', 'press_mid', 'press_att']]
-    press_att_perc = []
-    for index, row in high_press_df.iterrows():
-        num = (row.press_att/row.pressures)*100
-        press_att_perc.append(round(num, 1))
-    high_press_df["press_att%"] = press_att_perc
-    average_press_att = high_press_df["press_att%"].mean()
-    high_press_ranked = high_press_df.sort_values(by='press_att', ascending=False)
-    high_press_df["press_att_p90"] = high_press_df["press_att"]/high_press_df["90s"]
-    high_press_df = round(high_press_df[['team', 'press_att', 'press_att_p90']],1)
+def high_press(sources=None):
+    df = source_frame("defensive_actions_data.csv", sources)
+    high_press_df = compute_metrics(df, METRICS["high_press"])
+    high_press_df = high_press_df[['team', 'press_att', 'press_att_p90']]
     return high_press_df
 
-def crossing():
-    df = pd.read_csv("pass_types_data.csv")
-    crossing_df = df[['team', 'attempted', 'cross']]
-    crossing_perc = []
-    for index, row in crossing_df.iterrows():
-        num = (row.cross/row.attempted)*100
-        crossing_perc.append(round(num, 1))
-    crossing_df["cross%"] = crossing_perc
-    average_crosses = crossing_df["cross%"].mean()
-    crosses_ranked = crossing_df.sort_values(by='cross%', ascending=False)
+def crossing(sources=None):
+    df = source_frame("pass_types_data.csv", sources)
+    crossing_df = compute_metrics(df, METRICS["crossing"])
     crossing_df = crossing_df[['team', 'cross%']]
     return crossing_df
 
-def physicality():
-    df = pd.read_csv("misc_data.csv")
-    misc_df = df[['team', 'yellows', 'reds', 'fouls', 'aerials_won', 'aerials_lost', 'aerials_won%']]
-    aerials_ranked = misc_df.sort_values(by='aerials_won%', ascending=False)
-    fouls_ranked = misc_df.sort_values(by='fouls', ascending=False)
-    df = pd.read_csv("defensive_actions_data.csv")
-    tackles_df = df[['team', 'tackles', 'tackles_won']]
-    tackles_won_perc = []
-    for index, row in tackles_df.iterrows():
-        num = (row.tackles_won/row.tackles)*100
-        tackles_won_perc.append(round(num, 1))
-    tackles_df["tackles_won%"] = tackles_won_perc
-    average_tackles_won = tackles_df["tackles_won%"].mean()
-    tackles_ranked = tackles_df.sort_values(by='tackles_won%', ascending=False)
-    misc_df["tackles"] = tackles_df.tackles
-    misc_df["tackles_won"] = tackles_df.tackles_won
-    misc_df["tackles_won%"] = tackles_df["tackles_won%"]
-    misc_df = misc_df[['team', 'fouls', 'aerials_won%', 'tackles_won%']]
+def physicality(sources=None):
+    df = source_frame("misc_data.csv", sources)
+    misc_df = df[['team', 'fouls', 'aerials_won%']]
+    df = source_frame("defensive_actions_data.csv", sources)
+    tackles_df = compute_metrics(df, METRICS["physicality"])
+    misc_df = misc_df.merge(tackles_df[['team', 'tackles_won%']], on='team', validate='one_to_one')
     fouls_norm = round((1 + misc_df.fouls/misc_df.fouls.max()*9)*10,1)
     aerials_won_norm = round((1 + misc_df['aerials_won%']/misc_df['aerials_won%'].max()*9)*10,1)
     tackles_won_norm = round((1 + misc_df['tackles_won%']/misc_df['tackles_won%'].max()*9)*10,1)
@@ -353,77 +706,626 @@ def physicality():
     misc_df["physicality"] = physicality_score
     return misc_df
 
-def set_pieces():
-    df = pd.read_csv("goal_shot_creation_data.csv")
-    dead_balls_df = df[['team', 'shot_cre_acts', 'dead_sca']]
-    dead_balls_perc = []
-    for index, row in dead_balls_df.iterrows():
-        num = (row.dead_sca/row.shot_cre_acts)*100
-        dead_balls_perc.append(round(num, 1))
-    dead_balls_df["dead_balls%"] = dead_balls_perc
-    average_dead_balls = dead_balls_df["dead_balls%"].mean()
-    dead_balls_ranked = dead_balls_df.sort_values(by='dead_balls%', ascending=False)
+def set_pieces(sources=None):
+    df = source_frame("goal_shot_creation_data.csv", sources)
+    dead_balls_df = compute_metrics(df, METRICS["set_pieces"])
     dead_balls_df = dead_balls_df[['team', 'dead_balls%']]
     return dead_balls_df
 
-def shooting():
-    df = pd.read_csv("shooting_data.csv")
+def shooting(sources=None):
+    df = source_frame("shooting_data.csv", sources)
     shooting_df = df[['team','shots_p90', 'avg_dist', 'np_goals-xG']]
-    distance_ranked = shooting_df.sort_values(by='avg_dist', ascending=False)
-    shots_ranked = shooting_df.sort_values(by='shots_p90', ascending=False)
-    shooting_ranked = shooting_df.sort_values(by='np_goals-xG', ascending=False)
     return shooting_df
 
-def play_out():
-    df = pd.read_csv("goalkeepers_adv.csv")
+def play_out(sources=None):
+    df = source_frame("goalkeepers_adv.csv", sources)
     gk_df = df[['team', 'long_pass%', 'gk_long%', 'gk_avg_len']]
-    longgk_ranked = gk_df.sort_values(by='gk_long%', ascending=False)
-    longpass_ranked = gk_df.sort_values(by='long_pass%', ascending=False)
     gk_df["long%"] = round((gk_df["gk_long%"] + gk_df["long_pass%"])/2, 1)
     return gk_df
 
+# Save a feature table as one .npy file per column plus a meta.json, so it can be loaded without parsing csv files
+def write_feature_store(df, path, signature=()):
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype.kind not in "biuf":
+            values = np.asarray(df[column].astype(str).to_list())
+        np.save(os.path.join(path, str(i)+".npy"), values, allow_pickle=False)
+    with open(meta_path, "w") as f:
+        json.dump({"columns": list(df.columns), "signature": [list(s) for s in signature]}, f)
+
+# The meta.json of a feature store, or None if it is missing or was built from other source files
+def read_feature_store_meta(path, signature=None):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if signature is not None and meta["signature"] != [list(s) for s in signature]:
+        return None
+    return meta
+
+# Load a feature table saved by write_feature_store(), or None if it is missing or was built from other source files
+# With mmap_mode="r" the column files are memory-mapped, so only the requested columns and teams are read from disk
+def read_feature_store(path, signature=None, mmap_mode=None, columns=None, teams=None):
+    meta = read_feature_store_meta(path, signature)
+    if meta is None:
+        return None
+    files = {column: os.path.join(path, str(i)+".npy") for i, column in enumerate(meta["columns"])}
+    if columns is None:
+        columns = meta["columns"]
+    rows = slice(None)
+    if teams is not None:
+        rows = np.flatnonzero(np.isin(np.load(files["team"], mmap_mode=mmap_mode), list(teams)))
+    data = {}
+    for column in columns:
+        data[column] = np.load(files[column], mmap_mode=mmap_mode, allow_pickle=False)[rows]
+    return pd.DataFrame(data)
+
 # Gather primary and secondary features from the csv files in the project folder
-def playstyles_data():
-    pass_types_df = pass_distance()
-    pass_styles_df = pass_styles()
-    possession_types_df = possession_types()
-    possession_styles_df = possession_styles()
-    high_press_df = high_press()
-    crossing_df = crossing()
-    physicality_df = physicality()
-    set_pieces_df = set_pieces()
-    shooting_df = shooting()
-    play_out_df = play_out()
-    play_styles_df = pd.concat([pass_types_df, pass_styles_df, possession_types_df, possession_styles_df, high_press_df, crossing_df, physicality_df, set_pieces_df, shooting_df, play_out_df], axis=1)
-    play_styles_df = play_styles_df.loc[:,~play_styles_df.columns.duplicated()]
+# The merged table is built once and shared until one of the source files changes,
+# and with a cache_path it is also kept on disk so later runs skip csv parsing altogether
+def playstyles_data(cache_path=None):
+    signature = source_signature([source_path(file_name) for file_name in SOURCE_FILES])
+    if _features_cache.get("signature") != signature:
+        features = None
+        if cache_path is not None:
+            with timed("load_store"):
+                features = read_feature_store(cache_path, signature)
+        if features is None:
+            with profiled("playstyles_data"):
+                features = build_playstyles_data()
+            if cache_path is not None:
+                write_feature_store(features, cache_path, signature)
+        _features_cache["features"] = features
+        _features_cache["signature"] = signature
+    return _features_cache["features"].copy()
+
+# Register the source directory of a league season; its feature table is kept in a column store under STORE_DIR
+def register_dataset(league, season, data_dir, store_path=None):
+    if store_path is None:
+        store_path = os.path.join(STORE_DIR, league.replace(" ", "_"), season)
+    DATASETS[(league, season)] = {"data_dir": data_dir, "store": store_path}
+
+register_dataset(LEAGUE, SEASON, DATA_DIR)
+
+# Load the feature table of a registered dataset lazily from its memory-mapped column store,
+# reading only the given teams and columns. The store is rebuilt when its source csv files change,
+# and a store without source files next to it is used as it is. The csv files are parsed without
+# going through the csv cache, so loading many seasons does not keep their frames in memory.
+def load_dataset(league, season, teams=None, columns=None):
+    dataset = DATASETS[(league, season)]
+    paths = [source_path(file_name, dataset["data_dir"]) for file_name in SOURCE_FILES]
+    signature = None
+    if all(os.path.exists(path) for path in paths):
+        signature = source_signature(paths)
+        if read_feature_store_meta(dataset["store"], signature) is None:
+            sources = {file_name: parse_source(path) for file_name, path in zip(SOURCE_FILES, paths)}
+            write_feature_store(build_playstyles_data(sources), dataset["store"], signature)
+    if columns is not None:
+        columns = ["team"] + [column for column in columns if column != "team"]
+    features = read_feature_store(dataset["store"], signature, "r", columns, teams)
+    if features is None:
+        raise FileNotFoundError("No source files or feature store for %s %s" % (league, season))
+    return features
+
+# One team's features across seasons of a league, one row per season, touching only that team's rows
+def team_history(team, league=LEAGUE, seasons=None, columns=None):
+    if seasons is None:
+        seasons = sorted(season for dataset_league, season in DATASETS if dataset_league == league)
+    frames = []
+    for season in seasons:
+        features = load_dataset(league, season, [team], columns)
+        features.insert(1, "season", season)
+        frames.append(features)
+    return pd.concat(frames, ignore_index=True)
+
+# Mapping of team names, as they appear in the csv files, to the file names of their logos and charts
+# The teams.csv next to this script covers every dataset, and a teams.csv in the data directory adds to or overrides it,
+# so seasons kept in their own directories share the logos in LOGO_DIR
+def team_map(data_dir=None):
+    mapping = {}
+    for directory in [os.path.dirname(os.path.abspath(__file__)), data_dir or DATA_DIR]:
+        path = os.path.join(directory, TEAMS_FILE)
+        if os.path.exists(path):
+            teams = pd.read_csv(path)
+            mapping.update(zip(teams["team"], teams["file_name"]))
+    return mapping
+
+# File name of a team's logo and charts, defaulting to the team name without spaces
+def team_file_name(team, teams=None):
+    if teams is None:
+        teams = team_map()
+    return teams.get(team, team.replace(" ", ""))
+
+# Builders whose rows only depend on that team's own totals, and builders that compare teams across the league
+ROW_BUILDERS = [pass_distance, pass_styles, possession_styles, high_press, crossing, set_pieces, shooting, play_out]
+LEAGUE_BUILDERS = [possession_types, physicality]
+
+# Join the per-metric frames on team, so the builders may return their rows in any order
+# Sources default to the csv files in DATA_DIR
+def build_playstyles_data(sources=None):
+    frames = []
+    for builder in [pass_distance, pass_styles, possession_types, possession_styles, high_press, crossing,
+                    physicality, set_pieces, shooting, play_out]:
+        with timed("build_"+builder.__name__):
+            frames.append(builder(sources))
+    play_styles_df = frames[0]
+    with timed("merge_features"):
+        for frame in frames[1:]:
+            play_styles_df = play_styles_df.merge(frame, on='team', validate='one_to_one')
+    return play_styles_df
+
+# Source columns that are rates rather than counts: a matchweek updates them as an average weighted by 90s played
+# Besides these, percentages, per 90 and per shot columns and ratios such as ps_xG/SoT are rates
+RATE_COLUMNS = ["possession", "avg_dist", "gk_avg_len", "average_pass_len", "age", "def_actions_avgdist_FG"]
+# Columns that are neither summed nor averaged: a matchweek keeps the larger of the totals and the matchweek value,
+# since the number of distinct players used needs player-level data
+MAX_COLUMNS = ["players_used"]
+# Rates that can be recomputed exactly from the updated counts instead
+DERIVED_RATES = {
+    "misc_data.csv": [("aerials_won%", ["aerials_won"], ["aerials_won", "aerials_lost"], 100, 1, round_values)],
+    "shooting_data.csv": [
+        ("shots_p90", ["shots"], ["90s"], 1, 2, round_values),
+        ("goals_per_shot", ["goals"], ["shots"], 1, 2, round_values),
+        ("goals_per_SoT", ["goals"], ["SoT"], 1, 2, round_values),
+    ],
+}
+
+def is_rate_column(column):
+    return (column in RATE_COLUMNS or column.endswith("%") or "p90" in column or column.endswith("_90")
+            or "_per_" in column or "/" in column)
+
+# Running totals of every source file, the starting point for matchweek updates
+def load_totals():
+    return {file_name: read_source(file_name) for file_name in SOURCE_FILES}
+
+# Add one matchweek of per-team rows to the running totals of a source file
+# Counts are summed, rates are averaged weighted by 90s played, players_used keeps the larger value,
+# and teams not seen before are appended
+def add_matchweek_rows(totals_df, rows, file_name=None):
+    if "90s" not in rows.columns:
+        raise ValueError("Matchweek rows for %s have no 90s column to weight rates by" % (file_name or "a source file"))
+    totals_df = totals_df.set_index("team")
+    rows = rows.set_index("team")
+    new_teams = [team for team in rows.index if team not in totals_df.index]
+    totals_df = totals_df.reindex(list(totals_df.index) + new_teams)
+    columns = [column for column in rows.columns if column in totals_df.columns and column != "90s"
+               and pd.api.types.is_numeric_dtype(totals_df[column])]
+    old = totals_df.loc[rows.index]
+    old_90s = old["90s"].fillna(0)
+    for column in columns:
+        if column in MAX_COLUMNS:
+            totals_df.loc[rows.index, column] = np.fmax(old[column], rows[column])
+        elif is_rate_column(column):
+            totals_df.loc[rows.index, column] = ((old[column].fillna(0)*old_90s + rows[column]*rows["90s"])
+                                                 / (old_90s + rows["90s"]))
+        else:
+            totals_df.loc[rows.index, column] = old[column].fillna(0) + rows[column]
+    totals_df.loc[rows.index, "90s"] = old_90s + rows["90s"]
+    totals_df = totals_df.reset_index()
+    if file_name in DERIVED_RATES:
+        touched = totals_df.team.isin(rows.index)
+        totals_df.loc[touched] = compute_metrics(totals_df.loc[touched], DERIVED_RATES[file_name])
+    return totals_df
+
+# Apply a matchweek, given as a mapping of source file name to per-team rows, to the running totals
+# Returns the new totals and the set of teams the matchweek touched
+def apply_matchweek(totals, matchweek):
+    totals = dict(totals)
+    touched = set()
+    for file_name, rows in matchweek.items():
+        totals[file_name] = add_matchweek_rows(totals[file_name], rows, file_name)
+        touched.update(rows["team"])
+    return totals, touched
+
+# Update a feature table after a matchweek: per-team ratios are recomputed for the touched teams only,
+# while league-relative features (possession buckets, physicality) are recomputed for every team
+# As in build_playstyles_data(), a new team only joins the table once it has totals in every source file
+def update_playstyles_data(play_styles_df, totals, touched):
+    touched_totals = {file_name: frame.loc[frame.team.isin(touched)] for file_name, frame in totals.items()}
+    complete = set.intersection(*(set(totals[file_name].team) for file_name in SOURCE_FILES))
+    updated = play_styles_df.set_index("team")
+    updated = updated.reindex(list(updated.index) + sorted(complete.intersection(touched) - set(updated.index)))
+    for builder in ROW_BUILDERS + LEAGUE_BUILDERS:
+        frame = builder(totals if builder in LEAGUE_BUILDERS else touched_totals).set_index("team")
+        frame = frame.loc[frame.index.isin(updated.index)]
+        updated.loc[frame.index, frame.columns] = frame
+    return updated.reset_index()
+
+# Raise a ValueError unless an updated feature table has the same teams and values as a full rebuild from the totals
+def check_playstyles_update(play_styles_df, totals):
+    rebuilt = build_playstyles_data(totals).set_index("team").sort_index()
+    updated = play_styles_df.set_index("team").sort_index()
+    if list(updated.index) != list(rebuilt.index):
+        raise ValueError("Updated feature table has teams %s, a rebuild has %s"
+                         % (sorted(set(updated.index) - set(rebuilt.index)), sorted(set(rebuilt.index) - set(updated.index))))
+    for column in rebuilt.columns:
+        if not updated[column].astype(rebuilt[column].dtype).equals(rebuilt[column]):
+            raise ValueError("Updated feature table differs from a rebuild in "+column)
+
+# Charts whose plotted values, league medians or ranges differ between two feature tables, as (team, chart) pairs
+def changed_charts(old_df, new_df, charts=("primary", "secondary")):
+    old_summary = league_summary(old_df)
+    new_summary = league_summary(new_df)
+    old_rows = old_df.set_index("team")
+    new_rows = new_df.set_index("team")
+    changed = set()
+    for chart in charts:
+        spec = CHART_SPECS[chart]
+        columns = spec_columns(spec)
+        ranges_changed = any(not np.array_equal(old, new) for old, new in
+                             zip(chart_ranges(spec, old_summary), chart_ranges(spec, new_summary)))
+        for team in new_rows.index:
+            if (ranges_changed or team not in old_rows.index
+                    or not np.array_equal(old_rows.loc[team, columns].to_numpy(float),
+                                          new_rows.loc[team, columns].to_numpy(float), equal_nan=True)):
+                changed.add((team, chart))
+    return changed
+
+# Apply a matchweek to the running totals and the feature table, then re-render only the charts that changed
+# Returns the new totals, the new feature table and the render report
+# With check set, the updated table is compared against a full rebuild first, see check_playstyles_update()
+def refresh_matchweek(totals, play_styles_df, matchweek, workers=1, output_dir=None, fmt="png", dpi=200, check=False):
+    totals, touched = apply_matchweek(totals, matchweek)
+    updated_df = update_playstyles_data(play_styles_df, totals, touched)
+    if check:
+        check_playstyles_update(updated_df, totals)
+    summary = league_summary(updated_df)
+    changed = changed_charts(play_styles_df, updated_df)
+    teams = team_map()
+    jobs = []
+    for chart in CHART_SPECS:
+        names = sorted(team for team, changed_chart in changed if changed_chart == chart)
+        file_names = [team_file_name(name, teams) for name in names]
+        jobs += render_jobs(updated_df, names, file_names, [chart], summary, output_dir, fmt, dpi)
+    return totals, updated_df, render_batch(jobs, workers) if jobs else []
+
+# League medians, min/max and percentiles of every charted feature, computed once per dataset
+# Kept as plain dicts of floats, so a summary can be saved as json or handed to batch workers as is
+def league_summary(play_styles_df, percentiles=(10, 25, 75, 90)):
+    columns = charted_columns()
+    features = play_styles_df[columns]
+    stats = features.agg(["median", "min", "max"])
+    quantiles = features.quantile([p/100 for p in percentiles])
+    summary = {"teams": len(features)}
+    for stat in ["median", "min", "max"]:
+        summary[stat] = {column: float(value) for column, value in stats.loc[stat].items()}
+    summary["percentiles"] = {}
+    for p, (_, row) in zip(percentiles, quantiles.iterrows()):
+        summary["percentiles"][str(p)] = {column: float(value) for column, value in row.items()}
+    return summary
+
+def save_league_summary(summary, path):
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+def load_league_summary(path):
+    with open(path) as f:
+        return json.load(f)
+
+# Plot styles for a given team
+# outputs maps a chart type to a path or buffer to save it to, by default its file in OUTPUT_DIR
+def plot_style(team_name, name, summary=None, outputs=None):
+    outputs = outputs or {}
+    with profiled("plot_style"), timed("plot_style", team_name):
+        play_styles_df = playstyles_data()
+        if summary is None:
+            summary = league_summary(play_styles_df)
+        team_styles_df = play_styles_df.loc[play_styles_df.team == name]
+        plot_primary(summary, team_styles_df, team_name, outputs.get("primary"))
+        plot_secondary(summary, team_styles_df, team_name, outputs.get("secondary"))
+
+# Fitted clusterings, keyed on the feature data and the search settings
+_cluster_cache = {}
+
+# Fit one KMeans candidate on the PCA projection and score it by silhouette
+def fit_kmeans(projection, params, sample_size, random_state):
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    model = KMeans(**params).fit(projection)
+    if sample_size is not None and sample_size >= len(projection):
+        sample_size = None
+    score = silhouette_score(projection, model.labels_, sample_size=sample_size, random_state=random_state)
+    return params, model, score
+
+# Group teams into playing styles: scale the charted features, project them with PCA once,
+# then grid search KMeans over that projection in parallel and keep the model with the best silhouette score
+# Silhouette scores are computed on a sample of sample_size rows, which keeps large datasets fast
+def fit_play_style_clusters(play_styles_df, param_grid=None, n_components=0.9, n_jobs=-1, sample_size=5000,
+                            random_state=0):
+    from joblib import Parallel, delayed
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+    from sklearn.model_selection import ParameterGrid
+    features = play_styles_df[charted_columns()].to_numpy(dtype=float)
+    if param_grid is None:
+        param_grid = {"n_clusters": list(range(2, 9)), "n_init": [10], "random_state": [random_state]}
+    key = (hashlib.sha1(features.tobytes()).hexdigest(), features.shape, json.dumps(param_grid, sort_keys=True),
+           n_components, sample_size, random_state)
+    if key not in _cluster_cache:
+        scaler = StandardScaler().fit(features)
+        pca = PCA(n_components=n_components, random_state=random_state).fit(scaler.transform(features))
+        projection = pca.transform(scaler.transform(features))
+        candidates = [params for params in ParameterGrid(param_grid) if params["n_clusters"] < len(features)]
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(fit_kmeans)(projection, params, sample_size, random_state) for params in candidates
+        )
+        params, model, score = max(results, key=lambda result: result[2])
+        _cluster_cache[key] = {
+            "scaler": scaler,
+            "pca": pca,
+            "model": model,
+            "params": params,
+            "score": score,
+            "scores": [(result[0], result[2]) for result in results],
+        }
+    return _cluster_cache[key]
+
+# Charted features of every team with the id of its playing style cluster, as in play_styles_data.csv
+def cluster_play_styles(play_styles_df, **kwargs):
+    clustering = fit_play_style_clusters(play_styles_df, **kwargs)
+    play_styles_df = play_styles_df[["team"] + charted_columns()]
+    play_styles_df["play_style_id"] = clustering["model"].labels_
     return play_styles_df
 
-# Plot styles for a given team
-def plot_style(team_name, name):
-    play_styles_df = playstyles_data()
-    team_styles_df = play_styles_df.loc[play_styles_df.team == name]
-    average_df = pd.DataFrame()
-    average_df["long_attem%"] = [play_styles_df["long_attem%"].median()]
-    average_df["medium_attem%"] = play_styles_df["medium_attem%"].median()
-    average_df["short_attem%"] = play_styles_df["short_attem%"].median()
-    average_df["ground%"] = play_styles_df["ground%"].median()
-    average_df["low%"] = play_styles_df["low%"].median()
-    average_df["high%"] = play_styles_df["high%"].median()
-    average_df["possession"] = play_styles_df["possession"].median()
-    average_df["prog_distance%"] = play_styles_df["prog_distance%"].median()
-    average_df["press_att_p90"] = play_styles_df["press_att_p90"].median()
-    average_df["cross%"] = play_styles_df["cross%"].median()
-    average_df["physicality"] = play_styles_df["physicality"].median()
-    average_df["dead_balls%"] = play_styles_df["dead_balls%"].median()
-    average_df["np_goals-xG"] = play_styles_df["np_goals-xG"].median()
-    average_df["long%"] = play_styles_df["long%"].median()
-    plot_primary(play_styles_df, team_styles_df, average_df, team_name)
-    plot_secondary(play_styles_df, team_styles_df, average_df, team_name)
-
-# Plot styles for all teams
-def plot_styles_for_teams():
-    names = ["Arsenal", "Aston Villa", "Brentford", "Brighton", "Burnley", "Chelsea", "Crystal Palace", "Everton", "Leeds United", "Leicester City", "Liverpool", "Manchester City", "Manchester Utd", "Newcastle Utd", "Norwich City", "Southampton", "Tottenham", "Watford", "West Ham", "Wolves"]
-    file_names = ["Arsenal", "AstonVilla", "Brentford", "Brighton", "Burnley", "Chelsea", "CrystalPalace", "Everton", "Leeds", "Leicester", "Liverpool", "ManCity", "ManUtd", "Newcastle", "Norwich", "Southampton", "Spurs", "Watford", "WestHam", "Wolves"]
-
-    for i in range(len(names)):
-        plot_style(file_names[i], names[i])
+# The render job of one team's chart, from chart_data() computed over the league and the team's row in it
+def render_job_for(data, row, name, file_name, chart, output_dir=None, fmt="png", dpi=200, percentiles=False,
+                   season=None):
+    return {
+        "team": name,
+        "file_name": file_name,
+        "chart": chart,
+        "values": data["values"][row],
+        "compare_values": data["compare_values"],
+        "min_range": data["min_range"],
+        "max_range": data["max_range"],
+        "path": chart_path(file_name, chart, output_dir, fmt),
+        "fmt": fmt,
+        "dpi": dpi,
+        "percentiles": percentiles,
+        "season": season or SEASON,
+    }
+
+# Build one render job per team and chart type from an already computed feature table
+# Each job carries the team's values, the league medians and the slice ranges, so workers never read the csv files
+def render_jobs(play_styles_df, names, file_names, charts=("primary", "secondary"), summary=None,
+                output_dir=None, fmt="png", dpi=200, percentiles=False, season=None):
+    if summary is None:
+        summary = league_summary(play_styles_df)
+    rows = {team: i for i, team in enumerate(play_styles_df["team"])}
+    jobs = []
+    for chart in charts:
+        data = chart_data(CHART_SPECS[chart], play_styles_df, summary, percentiles)
+        for name, file_name in zip(names, file_names):
+            jobs.append(render_job_for(data, rows[name], name, file_name, chart, output_dir, fmt, dpi, percentiles,
+                                       season))
+    return jobs
+
+# Render a single job and report (team, chart, output path, error message or None, RSS growth in kB or None)
+def render_job(job):
+    import matplotlib.pyplot as plt
+    rss_before = rss_kb()
+    # a team missing a value, such as from a 0/0 ratio, fails on its own without touching the open templates
+    missing = [label for (label, *_), value in zip(CHART_SPECS[job["chart"]]["params"], job["values"])
+               if pd.isna(value)]
+    if missing:
+        error = "ValueError: no value for "+", ".join(missing)
+        return job["team"], job["chart"], job["path"], error, None
+    try:
+        with timed("render_job", job["file_name"]):
+            plot_from_template(job["chart"], job["values"], job["compare_values"], job["min_range"], job["max_range"],
+                               job["file_name"], job["path"], job["dpi"], job["fmt"], job["percentiles"],
+                               job["season"])
+        error = None
+    except Exception as e:
+        error = type(e).__name__+": "+str(e)
+        _templates.pop(job["chart"], None)
+        plt.close("all")
+    return job["team"], job["chart"], job["path"], error, record_rss(job["file_name"], rss_before)
+
+# Worker processes render without a display, so plt.show() never blocks
+# Resource directories are passed in, since workers may not inherit module globals
+def init_render_worker(font_dir=None, logo_dir=None):
+    global FONT_DIR, LOGO_DIR
+    FONT_DIR = font_dir or FONT_DIR
+    LOGO_DIR = logo_dir or LOGO_DIR
+    set_headless()
+
+# Render a job in a worker process, returning its report with the stage timings the worker took for it
+def render_job_with_metrics(job):
+    # a worker forked from a process running tracemalloc inherits it, which would only slow its renders down
+    import tracemalloc
+    tracemalloc.stop()
+    reset_metrics()
+    report = render_job(job)
+    return report, metrics()
+
+# Close the open chart templates, so figures of a finished batch do not stay registered with pyplot
+def close_templates():
+    import matplotlib.pyplot as plt
+    for _, chart_parts in _templates.values():
+        plt.close(chart_parts["fig"])
+    _templates.clear()
+
+# Render every job, across a process pool unless workers is 1, returning one report entry per job in job order
+# Jobs are only saved, never shown, so an in-process batch leaves the caller's backend alone and closes its templates
+# Stage timings taken in worker processes are merged into this process's metrics
+def render_batch(jobs, workers=None):
+    if workers == 1:
+        try:
+            return [render_job(job) for job in jobs]
+        finally:
+            close_templates()
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                             initargs=(FONT_DIR, LOGO_DIR)) as executor:
+        results = list(executor.map(render_job_with_metrics, jobs))
+    for _, worker_metrics in results:
+        merge_metrics(worker_metrics)
+    return [report for report, _ in results]
+
+# Plot styles for all teams, or only those given by csv name or file name
+# outputs maps (file name, chart type) to a path or buffer to save that chart to, by default its file in OUTPUT_DIR;
+# buffers are only filled when rendering in this process, with workers None or 1
+# With workers set, the charts are rendered in parallel and a per-job report is returned
+def plot_styles_for_teams(workers=None, teams=None, outputs=None):
+    outputs = outputs or {}
+    with profiled("plot_styles_for_teams"):
+        play_styles_df = playstyles_data()
+        summary = league_summary(play_styles_df)
+        names, file_names = select_teams(play_styles_df, teams)
+        if workers is None:
+            for name, file_name in zip(names, file_names):
+                plot_style(file_name, name, summary,
+                           {chart: outputs[(file_name, chart)] for chart in CHART_SPECS if (file_name, chart) in outputs})
+            return None
+        jobs = render_jobs(play_styles_df, names, file_names, summary=summary)
+        for job in jobs:
+            job["path"] = outputs.get((job["file_name"], job["chart"]), job["path"])
+        return render_batch(jobs, workers)
+
+# Fingerprint of everything that goes into a chart, used by incremental runs to skip unchanged charts
+def job_fingerprint(job):
+    spec = chart_spec(job["chart"], job["percentiles"], job["season"])
+    logo = os.path.join(LOGO_DIR, job["file_name"]+".png")
+    logo_stat = os.stat(logo) if os.path.exists(logo) else None
+    fonts = [os.path.exists(os.path.join(FONT_DIR, file_name)) for file_name in FONTS.values()]
+    content = [spec, job["file_name"], job["dpi"], job["fmt"], fonts,
+               logo_stat and [logo_stat.st_mtime_ns, logo_stat.st_size]]
+    for key in ["values", "compare_values", "min_range", "max_range"]:
+        content.append([float(value) for value in job[key]])
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+# Manifest of the fingerprints of the charts already rendered into an output directory
+def manifest_path(output_dir):
+    return os.path.join(output_dir, ".manifest.json")
+
+def load_manifest(output_dir):
+    path = manifest_path(output_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(manifest_path(output_dir), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Team names and file names of the teams in a feature table, optionally only those given by csv name or file name
+def select_teams(play_styles_df, teams=None):
+    mapping = team_map()
+    all_names = play_styles_df["team"].to_list()
+    all_file_names = [team_file_name(name, mapping) for name in all_names]
+    if not teams:
+        return all_names, all_file_names
+    names, file_names = [], []
+    for team in teams:
+        if team in all_names:
+            i = all_names.index(team)
+        elif team in all_file_names:
+            i = all_file_names.index(team)
+        else:
+            raise ValueError("Unknown team: "+team)
+        names.append(all_names[i])
+        file_names.append(all_file_names[i])
+    return names, file_names
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Plot pizza charts of Premier League team playing styles.")
+    parser.add_argument("--teams", nargs="+", metavar="TEAM",
+                        help="teams to plot, by csv name (\"Aston Villa\") or file name (AstonVilla); default all")
+    parser.add_argument("--charts", nargs="+", choices=list(CHART_SPECS), default=list(CHART_SPECS),
+                        help="chart types to plot; default all")
+    parser.add_argument("--league", default=LEAGUE, help="league of a registered dataset; default %(default)s")
+    parser.add_argument("--season", default=SEASON, help="season of a registered dataset; default %(default)s")
+    parser.add_argument("--data-dir", help="directory holding the source csv files, registered as --league and --season; default the registered dataset's")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="directory the charts are written to")
+    parser.add_argument("--font-dir", default=FONT_DIR, help="directory holding the Roboto fonts")
+    parser.add_argument("--logo-dir", default=LOGO_DIR, help="directory holding the team logos")
+    parser.add_argument("--cache", metavar="DIR", help="keep the feature table in DIR instead of the dataset's store under %s" % STORE_DIR)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--format", choices=["png", "svg", "pdf"], default="png")
+    parser.add_argument("--workers", type=int, default=1, help="render processes to use; default 1")
+    parser.add_argument("--percentiles", action="store_true",
+                        help="plot each value as the team's league percentile instead of against the league median")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip charts whose inputs have not changed since they were last rendered")
+    parser.add_argument("--summary", action="store_true",
+                        help="print the league summary as json and exit without rendering")
+    parser.add_argument("--cluster", metavar="FILE",
+                        help="write the charted features and a playing style id per team to FILE and exit without rendering")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write stage timings, per-team counters and any %s profiles to FILE as json" % PROFILE_ENV)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global DATA_DIR, FONT_DIR, LOGO_DIR, LEAGUE, SEASON
+    args = parse_args(argv)
+    if args.data_dir is not None:
+        register_dataset(args.league, args.season, args.data_dir)
+    elif (args.league, args.season) not in DATASETS:
+        print("Unknown dataset: %s %s" % (args.league, args.season), file=sys.stderr)
+        return 2
+    DATA_DIR = DATASETS[(args.league, args.season)]["data_dir"]
+    FONT_DIR, LOGO_DIR, LEAGUE, SEASON = args.font_dir, args.logo_dir, args.league, args.season
+    set_headless()
+    with profiled("main"):
+        status = run(args)
+    log_metrics()
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            json.dump(metrics(), f, indent=2)
+    return status
+
+# Build the features and render or export what the parsed command-line arguments ask for, returning the exit status
+# The features come from the dataset's feature store, or from the --cache directory when one is given
+def run(args):
+    try:
+        if args.cache:
+            play_styles_df = playstyles_data(args.cache)
+        else:
+            play_styles_df = load_dataset(args.league, args.season)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 2
+    summary = league_summary(play_styles_df)
+    if args.summary:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+        return 0
+    if args.cluster:
+        cluster_play_styles(play_styles_df).to_csv(args.cluster, index=False)
+        return 0
+
+    try:
+        names, file_names = select_teams(play_styles_df, args.teams)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    jobs = render_jobs(play_styles_df, names, file_names, args.charts, summary, args.output_dir, args.format, args.dpi,
+                       args.percentiles, args.season)
+    manifest = load_manifest(args.output_dir) if args.incremental else {}
+    fingerprints = {job["path"]: job_fingerprint(job) for job in jobs}
+    if args.incremental:
+        jobs = [job for job in jobs
+                if manifest.get(job["path"]) != fingerprints[job["path"]] or not os.path.exists(job["path"])]
+    print("Rendering %d of %d charts" % (len(jobs), len(fingerprints)))
+
+    failed = 0
+    for name, chart, path, error, rss_growth in render_batch(jobs, args.workers):
+        if error is None:
+            manifest[path] = fingerprints[path]
+        else:
+            failed += 1
+            manifest.pop(path, None)
+            print("%s %s: %s" % (name, chart, error), file=sys.stderr)
+    save_manifest(args.output_dir, manifest)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())